@@ -11,18 +11,26 @@ Date: 2025-01-04
 """
 
 import asyncio
-from threading import Thread
+import os
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import queue
+from types import SimpleNamespace
+from logging.handlers import QueueHandler, QueueListener
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.label import Label
-from kivy.uix.scrollview import ScrollView
-from kivy.uix.gridlayout import GridLayout
+from kivy.uix.image import Image
+from kivy.core.text import Label as CoreLabel
 from kivy.uix.popup import Popup
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.properties import StringProperty
+from kivy.metrics import dp
 from kivy.clock import Clock, mainthread
 from kivy.logger import Logger
-import time
 
 # Import our mesh controller
 try:
@@ -31,28 +39,163 @@ except ImportError:
     Logger.error("URBARN: Failed to import UrbanMeshController")
     UrbanMeshController = None
 
+# Faster libuv-based event loop when available
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Configure logging for Android
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hand app log records to a background listener so the UI thread never blocks on log I/O
+_log_queue = queue.Queue(-1)
+_log_listener = QueueListener(_log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+logger.addHandler(QueueHandler(_log_queue))
+logger.propagate = False
+_log_listener.start()
+
+# Status icons, rendered once into textures at startup
+STATUS_ICONS = {
+    'scan': '🔍',
+    'ok': '✅',
+    'error': '❌',
+    'connect': '🔗',
+    'auth': '🔐',
+    'light': '💡',
+    'refresh': '🔄',
+}
+
+class DeviceRow(BoxLayout):
+    """
+    Recycled row widget for a discovered device
+    """
+    
+    name = StringProperty('')
+    addr = StringProperty('')
+    
+    def __init__(self, **kwargs):
+        kwargs.setdefault('orientation', 'horizontal')
+        kwargs.setdefault('spacing', 5)
+        super().__init__(**kwargs)
+        
+        # Device info
+        info_layout = BoxLayout(orientation='vertical', size_hint_x=0.6)
+        
+        self.name_label = Label(
+            size_hint_y=None,
+            height='30dp',
+            text_size=(None, None),
+            font_size='14sp',
+            bold=True
+        )
+        info_layout.add_widget(self.name_label)
+        
+        self.addr_label = Label(
+            size_hint_y=None, 
+            height='25dp',
+            text_size=(None, None),
+            font_size='11sp'
+        )
+        info_layout.add_widget(self.addr_label)
+        
+        self.add_widget(info_layout)
+        
+        # Control buttons
+        button_layout = BoxLayout(orientation='horizontal', size_hint_x=0.4, spacing=3)
+        
+        connect_btn = Button(
+            text='🔗 Connect',
+            size_hint_x=0.5,
+            font_size='11sp'
+        )
+        connect_btn.bind(on_press=self.on_connect_pressed)
+        button_layout.add_widget(connect_btn)
+        
+        control_btn = Button(
+            text='💡 Control',
+            size_hint_x=0.5,
+            font_size='11sp'
+        )
+        control_btn.bind(on_press=self.on_control_pressed)
+        button_layout.add_widget(control_btn)
+        
+        self.add_widget(button_layout)
+        
+        self.bind(name=self.on_name_changed, addr=self.on_addr_changed)
+    
+    def on_name_changed(self, row, value):
+        """
+        Update name label when the row is recycled
+        """
+        self.name_label.text = f"📡 {value}"
+    
+    def on_addr_changed(self, row, value):
+        """
+        Update address label when the row is recycled
+        """
+        self.addr_label.text = f"📍 {value}"
+    
+    def on_connect_pressed(self, button):
+        """
+        Connect to the device shown in this row
+        """
+        record = App.get_running_app().get_discovered_record(self.addr)
+        if record is not None:
+            App.get_running_app().connect_device(record)
+    
+    def on_control_pressed(self, button):
+        """
+        Show controls for the device shown in this row
+        """
+        record = App.get_running_app().get_discovered_record(self.addr)
+        if record is not None:
+            App.get_running_app().show_device_controls(record)
+
 class UrbanApp(App):
     """
     Main Android app for URBARN light control
     """
     
+    # In-flight marker for mesh group commands, kept apart from device addresses
+    GROUP_INFLIGHT_KEY = 'group'
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         if UrbanMeshController is None:
             raise Exception("UrbanMeshController not available")
         self.controller = UrbanMeshController()
-        self.discovered_devices = []
+        self.discovered_records = []
         self.connected_devices = {}
         self.loop = None
         self.loop_thread = None
+        self._loop_ready = Event()
+        
+        # Bound concurrent GATT operations; both are only touched on the loop thread
+        self._gatt_sem = None
+        self._inflight = set()
+        
+        # Debounced triggers so a burst of presses fires a single BLE operation
+        self._pending_record = None
+        self._pending_scan_button = None
+        self._on_trigger = Clock.create_trigger(self._do_control_on, 0.15)
+        self._off_trigger = Clock.create_trigger(self._do_control_off, 0.15)
+        self._scan_trigger = Clock.create_trigger(self._do_scan, 0.15)
+        self._all_on_trigger = Clock.create_trigger(self._do_control_all_on, 0.15)
+        self._all_off_trigger = Clock.create_trigger(self._do_control_all_off, 0.15)
         
         # UI references
         self.status_label = None
-        self.device_layout = None
+        self.status_icon = None
+        self._icon_cache = {}
+        self._msg_popup = None
+        self._msg_label = None
+        self._about_popup = None
+        self._ctrl_popup = None
+        self._ctrl_title = None
+        self._ctrl_record = None
+        self.device_view = None
         self.scan_button = None
         self.main_layout = None
         
@@ -75,14 +218,29 @@ class UrbanApp(App):
         )
         self.main_layout.add_widget(title)
         
-        # Status label
+        # Pre-render status icons so updates only re-render plain text
+        for kind, icon in STATUS_ICONS.items():
+            core_label = CoreLabel(text=icon, font_size=dp(18))
+            core_label.refresh()
+            self._icon_cache[kind] = core_label.texture
+        
+        # Status icon and label
+        status_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height='40dp', spacing=5)
+        
+        self.status_icon = Image(
+            size_hint_x=None,
+            width='32dp',
+            opacity=0
+        )
+        status_layout.add_widget(self.status_icon)
+        
         self.status_label = Label(
             text='Ready to scan for URBARN devices...',
-            size_hint_y=None,
-            height='40dp',
             text_size=(None, None)
         )
-        self.main_layout.add_widget(self.status_label)
+        status_layout.add_widget(self.status_label)
+        
+        self.main_layout.add_widget(status_layout)
         
         # Control buttons
         button_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height='50dp', spacing=10)
@@ -110,43 +268,203 @@ class UrbanApp(App):
         
         self.main_layout.add_widget(button_layout)
         
-        # Scrollable device list
-        scroll = ScrollView()
-        self.device_layout = GridLayout(cols=1, spacing=5, size_hint_y=None)
-        self.device_layout.bind(minimum_height=self.device_layout.setter('height'))
-        scroll.add_widget(self.device_layout)
+        # Mesh-wide control buttons
+        group_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height='50dp', spacing=10)
+        
+        connect_all_button = Button(
+            text='🔗 Connect All',
+            size_hint_x=0.4
+        )
+        connect_all_button.bind(on_press=self.on_connect_all_pressed)
+        group_layout.add_widget(connect_all_button)
         
-        self.main_layout.add_widget(scroll)
+        all_on_button = Button(
+            text='💡 All ON',
+            size_hint_x=0.3
+        )
+        all_on_button.bind(on_press=lambda x: self.control_all(True))
+        group_layout.add_widget(all_on_button)
+        
+        all_off_button = Button(
+            text='⚫ All OFF',
+            size_hint_x=0.3
+        )
+        all_off_button.bind(on_press=lambda x: self.control_all(False))
+        group_layout.add_widget(all_off_button)
+        
+        self.main_layout.add_widget(group_layout)
+        
+        # Scrollable device list; only visible rows are instantiated
+        self.device_view = RecycleView(viewclass=DeviceRow)
+        device_layout = RecycleBoxLayout(
+            orientation='vertical',
+            spacing=5,
+            default_size=(None, dp(80)),
+            default_size_hint=(1, None),
+            size_hint_y=None
+        )
+        device_layout.bind(minimum_height=device_layout.setter('height'))
+        self.device_view.add_widget(device_layout)
+        
+        self.main_layout.add_widget(self.device_view)
+        
+        # Popups are built once and reconfigured on each open
+        self.build_popups()
         
         # Start asyncio loop in background thread
         self.start_async_loop()
         
         return self.main_layout
     
+    def build_popups(self):
+        """
+        Build the reusable message, about and device control popups
+        """
+        # Simple message popup
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        
+        self._msg_label = Label()
+        content.add_widget(self._msg_label)
+        
+        close_btn = Button(text='Close', size_hint_y=None, height='40dp')
+        content.add_widget(close_btn)
+        
+        self._msg_popup = Popup(
+            content=content,
+            size_hint=(0.7, 0.4)
+        )
+        close_btn.bind(on_press=self._msg_popup.dismiss)
+        
+        # About popup
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        
+        about_text = """
+🚀 URBARN Light Controller
+
+Custom Android app for controlling URBARN Bluetooth mesh lights using reverse-engineered credentials.
+
+🔐 Discovered Mesh Credentials:
+• Primary: URBARN / 15102
+• Secondary: Fulife / 2846
+
+✨ Features:
+• Scan for nearby URBARN devices
+• Connect and authenticate automatically
+• Control lights (ON/OFF)
+• No official app required!
+
+🛠️ Built with:
+• Python + Kivy
+• Bleak Bluetooth library
+• Reverse engineering analysis
+
+Author: Custom Development
+Date: 2025-01-04
+"""
+        
+        about_label = Label(
+            text=about_text,
+            text_size=(None, None),
+            valign='top'
+        )
+        content.add_widget(about_label)
+        
+        close_btn = Button(text='Close', size_hint_y=None, height='40dp')
+        content.add_widget(close_btn)
+        
+        self._about_popup = Popup(
+            title="About URBARN Controller",
+            content=content,
+            size_hint=(0.9, 0.8)
+        )
+        close_btn.bind(on_press=self._about_popup.dismiss)
+        
+        # Device control popup; buttons act on whichever device it was opened for
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        
+        self._ctrl_title = Label(
+            size_hint_y=None,
+            height='40dp',
+            font_size='16sp',
+            bold=True
+        )
+        content.add_widget(self._ctrl_title)
+        
+        # Light control buttons
+        button_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height='50dp')
+        
+        on_btn = Button(text='💡 Turn ON', size_hint_x=0.5)
+        on_btn.bind(on_press=lambda x: self.control_light(self._ctrl_record, True))
+        button_layout.add_widget(on_btn)
+        
+        off_btn = Button(text='⚫ Turn OFF', size_hint_x=0.5)
+        off_btn.bind(on_press=lambda x: self.control_light(self._ctrl_record, False))
+        button_layout.add_widget(off_btn)
+        
+        content.add_widget(button_layout)
+        
+        # Close button
+        close_btn = Button(text='Close', size_hint_y=None, height='40dp')
+        content.add_widget(close_btn)
+        
+        self._ctrl_popup = Popup(
+            title="Device Controls",
+            content=content,
+            size_hint=(0.8, 0.6)
+        )
+        close_btn.bind(on_press=self._ctrl_popup.dismiss)
+        
     def start_async_loop(self):
         """
         Start asyncio event loop in background thread
         """
         def run_loop():
-            self.loop = asyncio.new_event_loop()
+            # Keep BLE callbacks on the big cores of big.LITTLE devices (scheduling hint only)
+            if hasattr(os, 'sched_setaffinity'):
+                try:
+                    big_cores = {4, 5, 6, 7} & os.sched_getaffinity(0)
+                    if big_cores:
+                        os.sched_setaffinity(0, big_cores)
+                except OSError as e:
+                    Logger.warning(f"URBARN: Could not set loop thread affinity: {e}")
+            
+            if uvloop is not None:
+                self.loop = uvloop.new_event_loop()
+            else:
+                self.loop = asyncio.new_event_loop()
+            # Run submitted coroutines inline until they first suspend (Python 3.12+)
+            eager_task_factory = getattr(asyncio, 'eager_task_factory', None)
+            if eager_task_factory is not None:
+                self.loop.set_task_factory(eager_task_factory)
+            # Small bounded pool for any blocking work pushed off the loop
+            self.loop.set_default_executor(
+                ThreadPoolExecutor(max_workers=4, thread_name_prefix='urbarn')
+            )
             asyncio.set_event_loop(self.loop)
+            self._gatt_sem = asyncio.Semaphore(3)
+            self._loop_ready.set()
             self.loop.run_forever()
             
+        self._loop_ready.clear()
         self.loop_thread = Thread(target=run_loop, daemon=True)
         self.loop_thread.start()
         
         # Wait for loop to be ready
-        while self.loop is None:
-            time.sleep(0.01)
+        self._loop_ready.wait()
     
     @mainthread
-    def update_status(self, message):
+    def update_status(self, message, kind='info'):
         """
-        Update status label on main thread
+        Update status icon and label on main thread
         """
         if self.status_label:
-            self.status_label.text = message
-            Logger.info(f"URBARN: {message}")
+            texture = self._icon_cache.get(kind)
+            self.status_icon.texture = texture
+            self.status_icon.opacity = 1 if texture else 0
+            # Skip the texture re-render when the text is unchanged
+            if self.status_label.text != message:
+                self.status_label.text = message
+            logger.info("URBARN: %s", message)
     
     def on_scan_pressed(self, button):
         """
@@ -155,11 +473,19 @@ class UrbanApp(App):
         if self.loop and not self.loop.is_closed():
             # Disable button during scan
             button.disabled = True
-            button.text = "🔍 Scanning..."
+            if button.text != "🔍 Scanning...":
+                button.text = "🔍 Scanning..."
             
-            # Run scan in async loop
+            self._pending_scan_button = button
+            self._scan_trigger()
+    
+    def _do_scan(self, dt):
+        """
+        Run the debounced scan in the async loop
+        """
+        if self.loop and not self.loop.is_closed():
             asyncio.run_coroutine_threadsafe(
-                self.scan_for_devices_async(button), 
+                self.scan_for_devices_async(self._pending_scan_button), 
                 self.loop
             )
     
@@ -168,32 +494,41 @@ class UrbanApp(App):
         Async method to scan for devices
         """
         try:
-            self.update_status("🔍 Scanning for URBARN devices...")
+            self.update_status("Scanning for URBARN devices...", kind='scan')
             
             # Clear previous devices
-            self.discovered_devices = []
-            Clock.schedule_once(lambda dt: self.clear_device_list(), 0)
+            self.discovered_records = []
+            self.clear_device_list()
             
             # Scan for devices
-            devices = await self.controller.scan_for_urbarn_devices(scan_time=10)
+            devices = await self.controller.scan_for_urbarn_devices(scan_time=4, stop_after_count=8)
             
             if devices:
-                self.discovered_devices = devices
-                self.update_status(f"✅ Found {len(devices)} URBARN devices")
+                # Precompute display fields once per device
+                self.discovered_records = [
+                    SimpleNamespace(
+                        device=d,
+                        name=d.name or 'Unknown',
+                        addr=d.address,
+                        label=f"{d.name or 'Unknown'} ({d.address})"
+                    )
+                    for d in devices
+                ]
+                self.update_status(f"Found {len(devices)} URBARN devices", kind='ok')
                 
                 # Add devices to UI
-                Clock.schedule_once(lambda dt: self.populate_device_list(), 0)
+                self.populate_device_list()
                 
             else:
-                self.update_status("❌ No URBARN devices found. Make sure lights are on and nearby.")
+                self.update_status("No URBARN devices found. Make sure lights are on and nearby.", kind='error')
                 
         except Exception as e:
-            self.update_status(f"❌ Scan error: {str(e)}")
+            self.update_status(f"Scan error: {str(e)}", kind='error')
             Logger.error(f"URBARN: Scan error: {e}")
         
         finally:
             # Re-enable button
-            Clock.schedule_once(lambda dt: self.reset_scan_button(button), 0)
+            self.reset_scan_button(button)
     
     @mainthread
     def reset_scan_button(self, button):
@@ -201,201 +536,307 @@ class UrbanApp(App):
         Reset scan button state
         """
         button.disabled = False
-        button.text = "🔍 Scan for Devices"
+        if button.text != "🔍 Scan for Devices":
+            button.text = "🔍 Scan for Devices"
     
     @mainthread
     def clear_device_list(self):
         """
         Clear device list UI
         """
-        self.device_layout.clear_widgets()
+        self.device_view.data = []
     
     @mainthread  
     def populate_device_list(self):
         """
         Populate device list in UI
         """
-        self.device_layout.clear_widgets()
-        
-        for device in self.discovered_devices:
-            device_widget = self.create_device_widget(device)
-            self.device_layout.add_widget(device_widget)
+        self.device_view.data = [
+            {'name': record.name, 'addr': record.addr}
+            for record in self.discovered_records
+        ]
     
-    def create_device_widget(self, device):
-        """
-        Create a widget for a discovered device
+    def get_discovered_record(self, address):
         """
-        layout = BoxLayout(orientation='horizontal', size_hint_y=None, height='80dp', spacing=5)
-        
-        # Device info
-        info_layout = BoxLayout(orientation='vertical', size_hint_x=0.6)
+        Look up a device record from the latest scan by address
         
-        name_label = Label(
-            text=f"📡 {device.name or 'Unknown'}",
-            size_hint_y=None,
-            height='30dp',
-            text_size=(None, None),
-            font_size='14sp',
-            bold=True
-        )
-        info_layout.add_widget(name_label)
-        
-        addr_label = Label(
-            text=f"📍 {device.address}",
-            size_hint_y=None, 
-            height='25dp',
-            text_size=(None, None),
-            font_size='11sp'
-        )
-        info_layout.add_widget(addr_label)
-        
-        layout.add_widget(info_layout)
-        
-        # Control buttons
-        button_layout = BoxLayout(orientation='horizontal', size_hint_x=0.4, spacing=3)
-        
-        connect_btn = Button(
-            text='🔗 Connect',
-            size_hint_x=0.5,
-            font_size='11sp'
-        )
-        connect_btn.bind(on_press=lambda x: self.connect_device(device))
-        button_layout.add_widget(connect_btn)
-        
-        control_btn = Button(
-            text='💡 Control',
-            size_hint_x=0.5,
-            font_size='11sp'
-        )
-        control_btn.bind(on_press=lambda x: self.show_device_controls(device))
-        button_layout.add_widget(control_btn)
-        
-        layout.add_widget(button_layout)
-        
-        return layout
+        Rows keep only the address so recycled widgets never pin
+        devices from an earlier scan.
+        """
+        for record in self.discovered_records:
+            if record.addr == address:
+                return record
+        return None
     
-    def connect_device(self, device):
+    def connect_device(self, record):
         """
         Connect to a specific device
         """
         if self.loop and not self.loop.is_closed():
             asyncio.run_coroutine_threadsafe(
-                self.connect_device_async(device),
+                self.connect_device_async(record),
                 self.loop
             )
     
-    async def connect_device_async(self, device):
+    async def connect_device_async(self, record):
         """
         Async method to connect to device
         """
         try:
-            self.update_status(f"🔗 Connecting to {device.name or device.address}...")
-            
-            # Connect to device
-            success = await self.controller.connect_to_device(device)
-            
-            if success:
-                # Authenticate
-                self.update_status("🔐 Authenticating...")
-                auth_success = await self.controller.authenticate_with_mesh(device.address)
-                
-                if auth_success:
-                    self.connected_devices[device.address] = device
-                    self.update_status(f"✅ Connected and authenticated with {device.name or device.address}")
-                else:
-                    self.update_status(f"❌ Authentication failed for {device.name or device.address}")
-            else:
-                self.update_status(f"❌ Failed to connect to {device.name or device.address}")
-                
+            await self._connect_one(record, status=self.update_status)
         except Exception as e:
-            self.update_status(f"❌ Connection error: {str(e)}")
+            self.update_status(f"Connection error: {str(e)}", kind='error')
             Logger.error(f"URBARN: Connection error: {e}")
     
-    def show_device_controls(self, device):
+    def on_connect_all_pressed(self, button):
         """
-        Show control popup for device
+        Handle connect all button press
         """
-        if device.address not in self.connected_devices:
-            self.show_popup("Device Not Connected", "Please connect to this device first.")
+        if not self.discovered_records:
+            self.show_popup("No Devices", "Please scan for devices first.")
             return
         
-        # Create control popup
-        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        if self.loop and not self.loop.is_closed():
+            asyncio.run_coroutine_threadsafe(
+                self.connect_all_async(list(self.discovered_records)),
+                self.loop
+            )
+    
+    async def connect_all_async(self, records):
+        """
+        Async method to connect and authenticate all devices concurrently
+        """
+        self.update_status(f"Connecting to {len(records)} devices...", kind='connect')
         
-        title = Label(
-            text=f"Control {device.name or device.address}",
-            size_hint_y=None,
-            height='40dp',
-            font_size='16sp',
-            bold=True
+        results = await asyncio.gather(
+            *(self._connect_one(record) for record in records),
+            return_exceptions=True
         )
-        content.add_widget(title)
-        
-        # Light control buttons
-        button_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height='50dp')
         
-        on_btn = Button(text='💡 Turn ON', size_hint_x=0.5)
-        on_btn.bind(on_press=lambda x: self.control_light(device, True))
-        button_layout.add_widget(on_btn)
+        connected = 0
+        for record, result in zip(records, results):
+            if isinstance(result, Exception):
+                Logger.error(f"URBARN: Connection error for {record.addr}: {result}")
+            elif result:
+                connected += 1
+        
+        if connected:
+            self.update_status(f"Connected and authenticated with {connected}/{len(records)} devices", kind='ok')
+        else:
+            self.update_status("Failed to connect to any device", kind='error')
+    
+    async def _connect_one(self, record, status=None):
+        """
+        Connect and authenticate a single device, returning success
         
-        off_btn = Button(text='⚫ Turn OFF', size_hint_x=0.5)
-        off_btn.bind(on_press=lambda x: self.control_light(device, False))
-        button_layout.add_widget(off_btn)
+        Progress and the outcome are passed to status, if given, as update_status arguments.
+        """
+        report = status or (lambda message, kind='info': None)
         
-        content.add_widget(button_layout)
+        # Already connected and authenticated: keep using that session
+        if record.addr in self.connected_devices and self.controller.is_authenticated(record.addr):
+            report(f"Already connected to {record.label}", kind='ok')
+            return True
         
-        # Close button
-        close_btn = Button(text='Close', size_hint_y=None, height='40dp')
-        content.add_widget(close_btn)
+        # Drop duplicate requests for a device that is already busy
+        if record.addr in self._inflight:
+            Logger.info(f"URBARN: {record.addr} busy, ignoring connect request")
+            return False
+        self._inflight.add(record.addr)
         
-        popup = Popup(
-            title="Device Controls",
-            content=content,
-            size_hint=(0.8, 0.6)
-        )
+        try:
+            async with self._gatt_sem:
+                report(f"Connecting to {record.label}...", kind='connect')
+                if not await self.controller.connect_to_device(record.device):
+                    report(f"Failed to connect to {record.label}", kind='error')
+                    return False
+                
+                report("Authenticating...", kind='auth')
+                if not await self.controller.authenticate_with_mesh(record.addr):
+                    report(f"Authentication failed for {record.label}", kind='error')
+                    return False
+                
+                self.connected_devices[record.addr] = record
+                report(f"Connected and authenticated with {record.label}", kind='ok')
+                return True
+        finally:
+            self._inflight.discard(record.addr)
+    
+    def show_device_controls(self, record):
+        """
+        Show control popup for device
+        """
+        if record.addr not in self.connected_devices:
+            self.show_popup("Device Not Connected", "Please connect to this device first.")
+            return
         
-        close_btn.bind(on_press=popup.dismiss)
-        popup.open()
+        self._ctrl_record = record
+        self._ctrl_title.text = f"Control {record.label}"
+        self._ctrl_popup.open()
     
-    def control_light(self, device, turn_on):
+    def control_light(self, record, turn_on):
         """
         Control light on/off
         """
+        # Only the last press in a burst is sent
+        self._pending_record = record
+        if turn_on:
+            self._off_trigger.cancel()
+            self._on_trigger()
+        else:
+            self._on_trigger.cancel()
+            self._off_trigger()
+    
+    def _do_control_on(self, dt):
+        """
+        Send the debounced ON command
+        """
+        self._dispatch_control(True)
+    
+    def _do_control_off(self, dt):
+        """
+        Send the debounced OFF command
+        """
+        self._dispatch_control(False)
+    
+    def _dispatch_control(self, turn_on):
+        """
+        Run the pending light command in the async loop
+        """
+        record = self._pending_record
+        if record is None:
+            return
+        
         if self.loop and not self.loop.is_closed():
             asyncio.run_coroutine_threadsafe(
-                self.control_light_async(device, turn_on),
+                self.control_light_async(record, turn_on),
                 self.loop
             )
     
-    async def control_light_async(self, device, turn_on):
+    async def control_light_async(self, record, turn_on):
         """
         Async method to control light
         """
+        # Drop duplicate requests for a device that is already busy
+        if record.addr in self._inflight:
+            Logger.info(f"URBARN: {record.addr} busy, ignoring control request")
+            return
+        self._inflight.add(record.addr)
+        
         try:
-            action = "ON" if turn_on else "OFF"
-            self.update_status(f"💡 Turning {action} {device.name or device.address}...")
-            
-            if turn_on:
-                success = await self.controller.turn_on_light(device.address)
-            else:
-                success = await self.controller.turn_off_light(device.address)
-            
-            if success:
-                self.update_status(f"✅ Successfully turned {action} {device.name or device.address}")
-            else:
-                self.update_status(f"❌ Failed to turn {action} {device.name or device.address}")
+            async with self._gatt_sem:
+                action = "ON" if turn_on else "OFF"
+                self.update_status(f"Turning {action} {record.label}...", kind='light')
+                
+                if turn_on:
+                    success = await self.controller.turn_on_light(record.addr)
+                else:
+                    success = await self.controller.turn_off_light(record.addr)
+                
+                if success:
+                    self.update_status(f"Successfully turned {action} {record.label}", kind='ok')
+                else:
+                    self.update_status(f"Failed to turn {action} {record.label}", kind='error')
                 
         except Exception as e:
-            self.update_status(f"❌ Control error: {str(e)}")
+            self.update_status(f"Control error: {str(e)}", kind='error')
             Logger.error(f"URBARN: Control error: {e}")
+        finally:
+            self._inflight.discard(record.addr)
+    
+    def control_all(self, turn_on):
+        """
+        Control every light in the mesh on/off
+        """
+        if not self.connected_devices:
+            self.show_popup("No Connected Devices", "Please connect to a device first.")
+            return
+        
+        # Only the last press in a burst is sent
+        if turn_on:
+            self._all_off_trigger.cancel()
+            self._all_on_trigger()
+        else:
+            self._all_on_trigger.cancel()
+            self._all_off_trigger()
+    
+    def _do_control_all_on(self, dt):
+        """
+        Send the debounced group ON command
+        """
+        self._dispatch_control_all(True)
+    
+    def _do_control_all_off(self, dt):
+        """
+        Send the debounced group OFF command
+        """
+        self._dispatch_control_all(False)
+    
+    def _dispatch_control_all(self, turn_on):
+        """
+        Run the group command in the async loop
+        """
+        if self.loop and not self.loop.is_closed():
+            asyncio.run_coroutine_threadsafe(
+                self.control_all_async(turn_on),
+                self.loop
+            )
+    
+    async def control_all_async(self, turn_on):
+        """
+        Async method to control all lights with a single mesh group write
+        """
+        # Drop duplicate group requests while one is still being sent
+        if self.GROUP_INFLIGHT_KEY in self._inflight:
+            Logger.info("URBARN: Group command busy, ignoring control request")
+            return
+        
+        action = "ON" if turn_on else "OFF"
+        
+        # Any live, authenticated node that is not busy relays the group command to the whole mesh
+        address = next(
+            (
+                addr for addr in list(self.connected_devices)
+                if addr not in self._inflight and self.controller.is_authenticated(addr)
+            ),
+            None
+        )
+        if address is None:
+            self.update_status(f"No idle authenticated device to turn all lights {action}", kind='error')
+            return
+        
+        # Mark the relay busy too so no per-device operation overlaps on its connection
+        self._inflight.add(self.GROUP_INFLIGHT_KEY)
+        self._inflight.add(address)
+        
+        try:
+            async with self._gatt_sem:
+                self.update_status(f"Turning all lights {action}...", kind='light')
+                
+                if turn_on:
+                    success = await self.controller.turn_on_group(address)
+                else:
+                    success = await self.controller.turn_off_group(address)
+                
+                if success:
+                    self.update_status(f"Successfully turned all lights {action}", kind='ok')
+                else:
+                    self.update_status(f"Failed to turn all lights {action}", kind='error')
+                
+        except Exception as e:
+            self.update_status(f"Control error: {str(e)}", kind='error')
+            Logger.error(f"URBARN: Group control error: {e}")
+        finally:
+            self._inflight.discard(address)
+            self._inflight.discard(self.GROUP_INFLIGHT_KEY)
     
     def on_refresh_pressed(self, button):
         """
         Handle refresh button
         """
-        self.update_status("🔄 Refreshing...")
-        Clock.schedule_once(lambda dt: self.clear_device_list(), 0)
-        self.discovered_devices = []
+        self.update_status("Refreshing...", kind='refresh')
+        self.clear_device_list()
+        self.discovered_records = []
         self.connected_devices = {}
         self.update_status("Ready to scan for URBARN devices...")
     
@@ -403,71 +844,15 @@ class UrbanApp(App):
         """
         Show about popup
         """
-        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
-        
-        about_text = """
-🚀 URBARN Light Controller
-
-Custom Android app for controlling URBARN Bluetooth mesh lights using reverse-engineered credentials.
-
-🔐 Discovered Mesh Credentials:
-• Primary: URBARN / 15102
-• Secondary: Fulife / 2846
-
-✨ Features:
-• Scan for nearby URBARN devices
-• Connect and authenticate automatically
-• Control lights (ON/OFF)
-• No official app required!
-
-🛠️ Built with:
-• Python + Kivy
-• Bleak Bluetooth library
-• Reverse engineering analysis
-
-Author: Custom Development
-Date: 2025-01-04
-"""
-        
-        about_label = Label(
-            text=about_text,
-            text_size=(None, None),
-            valign='top'
-        )
-        content.add_widget(about_label)
-        
-        close_btn = Button(text='Close', size_hint_y=None, height='40dp')
-        content.add_widget(close_btn)
-        
-        popup = Popup(
-            title="About URBARN Controller",
-            content=content,
-            size_hint=(0.9, 0.8)
-        )
-        
-        close_btn.bind(on_press=popup.dismiss)
-        popup.open()
+        self._about_popup.open()
     
     def show_popup(self, title, message):
         """
         Show a simple popup message
         """
-        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
-        
-        label = Label(text=message)
-        content.add_widget(label)
-        
-        close_btn = Button(text='Close', size_hint_y=None, height='40dp')
-        content.add_widget(close_btn)
-        
-        popup = Popup(
-            title=title,
-            content=content,
-            size_hint=(0.7, 0.4)
-        )
-        
-        close_btn.bind(on_press=popup.dismiss)
-        popup.open()
+        self._msg_popup.title = title
+        self._msg_label.text = message
+        self._msg_popup.open()
     
     def on_stop(self):
         """
@@ -483,6 +868,9 @@ Date: 2025-01-04
             # Stop the loop
             self.loop.call_soon_threadsafe(self.loop.stop)
         
+        # Flush queued log records
+        _log_listener.stop()
+        
         return True
 
 if __name__ == '__main__':
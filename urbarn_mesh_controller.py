@@ -13,12 +13,22 @@ Date: 2024-09-04
 import asyncio
 import struct
 import logging
+import json
+import os
 from bleak import BleakScanner, BleakClient
 from bleak.backends.characteristic import BleakGATTCharacteristic
 from bleak.backends.device import BLEDevice
-from typing import List, Dict, Optional, Tuple
+from bleak.exc import BleakError
+from typing import List, Dict, Optional, Set, Tuple
 import time
-import binascii
+
+# Optional: only needed for encrypted authentication (method 3)
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.primitives import padding
+    _HAS_CRYPTO = True
+except ImportError:
+    _HAS_CRYPTO = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -33,15 +43,16 @@ class UrbanMeshController:
     - Secondary Mesh: Fulife / 2846
     """
     
-    # Discovered mesh credentials from app analysis
+    # Discovered mesh credentials from app analysis, pre-encoded for transmission
     MESH_CREDENTIALS = {
-        'primary': {'name': 'URBARN', 'password': '15102'},
-        'secondary': {'name': 'Fulife', 'password': '2846'}
+        'primary': {'name': b'URBARN', 'password': b'15102', 'combined': b'URBARN:15102'},
+        'secondary': {'name': b'Fulife', 'password': b'2846', 'combined': b'Fulife:2846'}
     }
     
     # Discovered AES encryption keys
     AES_KEY = bytes.fromhex('d571f6c5851265bcd5bb684aa937aa7c3df76ffce7fb11250ba292d63194d677')
     AES_IV = bytes.fromhex('a91818db066216501caad41d5982e638')
+    _AES_CIPHER = Cipher(algorithms.AES(AES_KEY[:32]), modes.CBC(AES_IV[:16])) if _HAS_CRYPTO else None
     
     # Common Bluetooth mesh service UUIDs
     MESH_SERVICE_UUIDS = [
@@ -50,6 +61,27 @@ class UrbanMeshController:
         "0000fe59-0000-1000-8000-00805f9b34fb",  # Generic mesh service
         "000016fe-0000-1000-8000-00805f9b34fb",  # Another common mesh UUID
     ]
+    _MESH_SERVICE_UUIDS_LOWER = frozenset(uuid.lower() for uuid in MESH_SERVICE_UUIDS)
+    
+    # Mesh group address used to reach every light with a single relayed write
+    MESH_GROUP_ADDRESS = 0xC000
+    
+    # Pre-compiled light command layouts
+    _CMD_SIMPLE = struct.Struct('<BHB')
+    _CMD_EXTENDED = struct.Struct('<BBHB')
+    _CMD_MESH = struct.Struct('<BBBH')
+    
+    # Device name patterns found in the app
+    DEVICE_PATTERNS = [
+        'URBARN',
+        'Fulife', 
+        'Mesh',
+        'Light',
+        # Generic patterns that might match
+        'BT',
+        'LED',
+    ]
+    _DEVICE_PATTERNS_LOWER = tuple(pattern.lower() for pattern in DEVICE_PATTERNS)
     
     # Potential characteristic UUIDs for mesh communication
     MESH_CHAR_UUIDS = [
@@ -62,77 +94,104 @@ class UrbanMeshController:
         "0000fff3-0000-1000-8000-00805f9b34fb",  # Generic read
         "0000fff4-0000-1000-8000-00805f9b34fb",  # Generic indication
     ]
+    _MESH_CHAR_UUIDS_LOWER = frozenset(uuid.lower() for uuid in MESH_CHAR_UUIDS)
+    
+    # On-disk record of which authentication method each device accepted
+    AUTH_CACHE_PATH = os.path.expanduser('~/.cache/urbarn_auth.json')
     
     def __init__(self):
         self.discovered_devices: List[BLEDevice] = []
+        self._seen_addresses: Set[str] = set()
+        self._scanner: Optional[BleakScanner] = None
+        self._scan_done: Optional[asyncio.Event] = None
+        self._scan_stop_after: Optional[int] = None
         self.connected_devices: Dict[str, BleakClient] = {}
-        self.device_characteristics: Dict[str, Dict[str, BleakGATTCharacteristic]] = {}
-        self.authenticated_devices: Dict[str, bool] = {}
+        # Per device: role ("mesh", "writable", "notify") -> characteristics serving it
+        self.device_characteristics: Dict[str, Dict[str, List[BleakGATTCharacteristic]]] = {}
+        self.authenticated_devices: Set[str] = set()
+        # Last successful authentication method number per device
+        self._auth_cache: Dict[str, int] = self._load_auth_cache()
+        self._auth_save_lock: Optional[asyncio.Lock] = None
+        self._enc_auth: Dict[bytes, bytes] = {}
+        self._command_events: Dict[str, Optional[asyncio.Event]] = {}
         
-    async def scan_for_urbarn_devices(self, scan_time: int = 10) -> List[BLEDevice]:
+    async def scan_for_urbarn_devices(self, scan_time: int = 10, stop_after_count: Optional[int] = None) -> List[BLEDevice]:
         """
         Scan for URBARN mesh devices using discovered patterns
+        
+        The scan ends early once stop_after_count devices have been found.
         """
         logger.info(f"Scanning for URBARN devices for {scan_time} seconds...")
         
-        # Device name patterns found in the app
-        device_patterns = [
-            'URBARN',
-            'Fulife', 
-            'Mesh',
-            'Light',
-            # Generic patterns that might match
-            'BT',
-            'LED',
-        ]
-        
         self.discovered_devices = []
+        self._seen_addresses = set()
+        self._scan_done = asyncio.Event()
+        self._scan_stop_after = stop_after_count
         
-        def detection_callback(device: BLEDevice, advertisement_data):
-            device_name = device.name or "Unknown"
-            
-            # Check for URBARN-specific patterns
-            is_urbarn_device = False
-            
-            # Check name patterns
-            for pattern in device_patterns:
-                if pattern.lower() in device_name.lower():
-                    is_urbarn_device = True
-                    break
-            
-            # Check for mesh service UUIDs
-            if not is_urbarn_device:
-                for service_uuid in self.MESH_SERVICE_UUIDS:
-                    if service_uuid in advertisement_data.service_uuids:
-                        is_urbarn_device = True
-                        break
-            
-            # Check for strong signal (likely nearby URBARN lights)
-            if not is_urbarn_device and advertisement_data.rssi and advertisement_data.rssi > -60:
-                # If it's a strong signal and has any service UUIDs, consider it
-                if advertisement_data.service_uuids:
-                    is_urbarn_device = True
-            
-            if is_urbarn_device:
-                if device not in self.discovered_devices:
-                    logger.info(f"Found potential URBARN device: {device_name} ({device.address}) RSSI: {advertisement_data.rssi}")
-                    logger.info(f"  Services: {advertisement_data.service_uuids}")
-                    logger.info(f"  Manufacturer data: {advertisement_data.manufacturer_data}")
-                    self.discovered_devices.append(device)
-        
-        scanner = BleakScanner(detection_callback=detection_callback)
-        await scanner.start()
-        await asyncio.sleep(scan_time)
-        await scanner.stop()
+        # Reuse one scanner across calls
+        if self._scanner is None:
+            # Active mode maps to SCAN_MODE_LOW_LATENCY with a report delay of 0
+            # on Bleak's Android backend, so results are delivered without batching
+            self._scanner = BleakScanner(
+                detection_callback=self._on_advertisement,
+                scanning_mode="active"
+            )
+        
+        # The context manager stops the radio even if the scan is cancelled
+        async with self._scanner:
+            try:
+                await asyncio.wait_for(self._scan_done.wait(), timeout=scan_time)
+            except asyncio.TimeoutError:
+                pass
         
         logger.info(f"Found {len(self.discovered_devices)} potential URBARN devices")
         return self.discovered_devices
     
+    def _on_advertisement(self, device: BLEDevice, advertisement_data):
+        """
+        Scanner callback: record advertisements that look like URBARN devices
+        """
+        # Devices already recorded are skipped with a single hash lookup
+        addr = device.address
+        if addr in self._seen_addresses:
+            return
+        
+        device_name = device.name or "Unknown"
+        name_lower = device_name.lower()
+        
+        # Check name patterns, then mesh service UUIDs
+        is_urbarn_device = (
+            any(pattern in name_lower for pattern in self._DEVICE_PATTERNS_LOWER)
+            or not self._MESH_SERVICE_UUIDS_LOWER.isdisjoint(uuid.lower() for uuid in advertisement_data.service_uuids)
+        )
+        
+        # Check for strong signal (likely nearby URBARN lights)
+        if not is_urbarn_device and advertisement_data.rssi and advertisement_data.rssi > -60:
+            # If it's a strong signal and has any service UUIDs, consider it
+            if advertisement_data.service_uuids:
+                is_urbarn_device = True
+        
+        if is_urbarn_device:
+            self._seen_addresses.add(addr)
+            logger.info(f"Found potential URBARN device: {device_name} ({addr}) RSSI: {advertisement_data.rssi}")
+            logger.info(f"  Services: {advertisement_data.service_uuids}")
+            logger.info(f"  Manufacturer data: {advertisement_data.manufacturer_data}")
+            self.discovered_devices.append(device)
+            
+            if self._scan_stop_after and len(self.discovered_devices) >= self._scan_stop_after:
+                self._scan_done.set()
+    
     async def connect_to_device(self, device: BLEDevice) -> bool:
         """
         Connect to a specific device and discover characteristics
         """
         try:
+            # Reuse a live connection instead of reconnecting and rediscovering
+            existing = self.connected_devices.get(device.address)
+            if existing and existing.is_connected:
+                logger.info(f"Reusing existing connection to {device.address}")
+                return True
+            
             logger.info(f"Connecting to {device.name or 'Unknown'} ({device.address})")
             
             client = BleakClient(device.address)
@@ -144,6 +203,8 @@ class UrbanMeshController:
             
             logger.info(f"Connected to {device.address}")
             self.connected_devices[device.address] = client
+            self._command_events.pop(device.address, None)
+            self.authenticated_devices.discard(device.address)
             
             # Discover services and characteristics
             await self._discover_characteristics(device.address)
@@ -154,6 +215,15 @@ class UrbanMeshController:
             logger.error(f"Error connecting to {device.address}: {e}")
             return False
     
+    def is_authenticated(self, device_address: str) -> bool:
+        """
+        Check whether a device has a live, authenticated connection
+        """
+        client = self.connected_devices.get(device_address)
+        if not client or not client.is_connected:
+            return False
+        return device_address in self.authenticated_devices
+    
     async def _discover_characteristics(self, device_address: str):
         """
         Discover and catalog characteristics for mesh communication
@@ -163,7 +233,7 @@ class UrbanMeshController:
             return
         
         logger.info(f"Discovering characteristics for {device_address}")
-        self.device_characteristics[device_address] = {}
+        buckets = self.device_characteristics[device_address] = {"mesh": [], "writable": [], "notify": []}
         
         try:
             services = client.services
@@ -176,23 +246,65 @@ class UrbanMeshController:
                     logger.info(char_info)
                     
                     # Store potentially useful characteristics
-                    if any(uuid.lower() in char.uuid.lower() for uuid in self.MESH_CHAR_UUIDS):
-                        self.device_characteristics[device_address][char.uuid] = char
+                    if char.uuid.lower() in self._MESH_CHAR_UUIDS_LOWER:
+                        buckets["mesh"].append(char)
                         logger.info(f"    -> Stored as potential mesh characteristic")
                     
                     # Store writable characteristics
                     if "write" in char.properties or "write-without-response" in char.properties:
-                        self.device_characteristics[device_address][f"writable_{char.uuid}"] = char
+                        buckets["writable"].append(char)
                         logger.info(f"    -> Stored as writable characteristic")
                     
                     # Store notification characteristics  
                     if "notify" in char.properties or "indicate" in char.properties:
-                        self.device_characteristics[device_address][f"notify_{char.uuid}"] = char
+                        buckets["notify"].append(char)
                         logger.info(f"    -> Stored as notification characteristic")
                         
         except Exception as e:
             logger.error(f"Error discovering characteristics: {e}")
     
+    def _load_auth_cache(self) -> Dict[str, int]:
+        """
+        Load the authentication method cache from disk
+        """
+        try:
+            with open(self.AUTH_CACHE_PATH, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable auth cache: {e}")
+            return {}
+        
+        if not isinstance(data, dict):
+            logger.warning("Ignoring auth cache that is not a JSON object")
+            return {}
+        return data
+    
+    def _save_auth_cache(self, data: Dict[str, int]):
+        """
+        Write the authentication method cache to disk
+        """
+        try:
+            os.makedirs(os.path.dirname(self.AUTH_CACHE_PATH), exist_ok=True)
+            with open(self.AUTH_CACHE_PATH, 'w') as f:
+                json.dump(data, f)
+        except OSError as e:
+            logger.warning(f"Could not save auth cache: {e}")
+    
+    async def _persist_auth_cache(self):
+        """
+        Save the authentication method cache in the default executor, one save at a time
+        """
+        if self._auth_save_lock is None:
+            self._auth_save_lock = asyncio.Lock()
+        
+        async with self._auth_save_lock:
+            # Snapshot inside the lock so the last save to land holds the newest entries
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._save_auth_cache, dict(self._auth_cache)
+            )
+    
     async def authenticate_with_mesh(self, device_address: str, use_secondary_creds: bool = False) -> bool:
         """
         Attempt to authenticate with the mesh using discovered credentials
@@ -204,10 +316,13 @@ class UrbanMeshController:
         
         # Choose credentials
         creds = self.MESH_CREDENTIALS['secondary' if use_secondary_creds else 'primary']
-        mesh_name = creds['name']
-        mesh_password = creds['password']
         
-        logger.info(f"Attempting mesh authentication with {mesh_name}/{mesh_password}")
+        # Every method writes to the same characteristics, so none can succeed without them
+        if not self.device_characteristics.get(device_address, {}).get("writable"):
+            logger.error(f"No writable characteristics on {device_address}, cannot authenticate")
+            return False
+        
+        logger.info(f"Attempting mesh authentication with {creds['name'].decode()}/{creds['password'].decode()}")
         
         # Try multiple authentication approaches based on app analysis
         auth_methods = [
@@ -216,21 +331,54 @@ class UrbanMeshController:
             self._auth_method_3,
         ]
         
-        for i, auth_method in enumerate(auth_methods, 1):
+        # Try the method that last worked for this device first
+        order = list(range(1, len(auth_methods) + 1))
+        cached = self._auth_cache.get(device_address)
+        if cached in order:
+            order.remove(cached)
+            order.insert(0, cached)
+        
+        for i in order:
+            auth_method = auth_methods[i - 1]
             logger.info(f"Trying authentication method {i}")
             try:
-                success = await auth_method(device_address, mesh_name, mesh_password)
+                success = await auth_method(device_address, creds)
                 if success:
                     logger.info(f"Authentication successful with method {i}")
-                    self.authenticated_devices[device_address] = True
+                    self.authenticated_devices.add(device_address)
+                    if cached != i:
+                        self._auth_cache[device_address] = i
+                        await self._persist_auth_cache()
                     return True
             except Exception as e:
                 logger.warning(f"Authentication method {i} failed: {e}")
+                if self._is_auth_rejection(e):
+                    # The device refused these credentials; the other methods would be refused too
+                    break
         
         logger.error(f"All authentication methods failed for {device_address}")
         return False
     
-    async def _auth_method_1(self, device_address: str, mesh_name: str, mesh_password: str) -> bool:
+    @staticmethod
+    def _is_auth_rejection(error: Exception) -> bool:
+        """
+        Check whether an error means the device rejected us rather than a transport failure
+        """
+        return isinstance(error, BleakError) and 'not authorized' in str(error).lower()
+    
+    async def _write_acknowledged(self, client: BleakClient, characteristic: BleakGATTCharacteristic, data: bytes):
+        """
+        Write data and wait for the ATT write response instead of a fixed delay
+        
+        Characteristics without write-with-response only get a single loop yield.
+        """
+        if "write" in characteristic.properties:
+            await client.write_gatt_char(characteristic, data, response=True)
+        else:
+            await client.write_gatt_char(characteristic, data, response=False)
+            await asyncio.sleep(0)
+    
+    async def _auth_method_1(self, device_address: str, creds: Dict[str, bytes]) -> bool:
         """
         Authentication method 1: Direct credential transmission
         """
@@ -238,29 +386,27 @@ class UrbanMeshController:
         characteristics = self.device_characteristics.get(device_address, {})
         
         # Try sending credentials to writable characteristics
-        for char_key, characteristic in characteristics.items():
-            if "writable" in char_key:
-                try:
-                    # Format 1: Name + Password as UTF-8
-                    auth_data = f"{mesh_name}:{mesh_password}".encode('utf-8')
-                    await client.write_gatt_char(characteristic, auth_data)
-                    await asyncio.sleep(0.5)
-                    
-                    # Format 2: Binary packed
-                    auth_data = struct.pack(f'<{len(mesh_name)}s{len(mesh_password)}s', 
-                                          mesh_name.encode(), mesh_password.encode())
-                    await client.write_gatt_char(characteristic, auth_data)
-                    await asyncio.sleep(0.5)
-                    
-                    logger.info(f"Sent auth data to {characteristic.uuid}")
-                    return True
-                    
-                except Exception as e:
-                    logger.debug(f"Auth method 1 failed on {characteristic.uuid}: {e}")
+        for characteristic in characteristics.get("writable", []):
+            try:
+                # Format 1: Name + Password as UTF-8
+                auth_data = creds['combined']
+                await self._write_acknowledged(client, characteristic, auth_data)
+                
+                # Format 2: Binary packed
+                auth_data = creds['name'] + creds['password']
+                await self._write_acknowledged(client, characteristic, auth_data)
+                
+                logger.info(f"Sent auth data to {characteristic.uuid}")
+                return True
+                
+            except Exception as e:
+                if self._is_auth_rejection(e):
+                    raise
+                logger.debug("Auth method 1 failed on %s: %s", characteristic.uuid, e)
         
         return False
     
-    async def _auth_method_2(self, device_address: str, mesh_name: str, mesh_password: str) -> bool:
+    async def _auth_method_2(self, device_address: str, creds: Dict[str, bytes]) -> bool:
         """
         Authentication method 2: Mesh protocol specific
         """
@@ -268,66 +414,76 @@ class UrbanMeshController:
         characteristics = self.device_characteristics.get(device_address, {})
         
         # Try mesh-specific authentication sequences
-        for char_key, characteristic in characteristics.items():
-            if "writable" in char_key:
-                try:
-                    # Mesh login sequence based on app patterns
-                    login_sequence = [
-                        b'\x01\x02',  # Login command
-                        mesh_name.encode('utf-8'),
-                        mesh_password.encode('utf-8'),
-                        b'\x03\x04',  # End sequence
-                    ]
-                    
-                    for data in login_sequence:
-                        await client.write_gatt_char(characteristic, data)
-                        await asyncio.sleep(0.2)
-                    
-                    return True
-                    
-                except Exception as e:
-                    logger.debug(f"Auth method 2 failed on {characteristic.uuid}: {e}")
+        for characteristic in characteristics.get("writable", []):
+            try:
+                # Mesh login sequence based on app patterns
+                login_sequence = [
+                    b'\x01\x02',  # Login command
+                    creds['name'],
+                    creds['password'],
+                    b'\x03\x04',  # End sequence
+                ]
+                
+                for data in login_sequence:
+                    await self._write_acknowledged(client, characteristic, data)
+                
+                return True
+                
+            except Exception as e:
+                if self._is_auth_rejection(e):
+                    raise
+                logger.debug("Auth method 2 failed on %s: %s", characteristic.uuid, e)
         
         return False
     
-    async def _auth_method_3(self, device_address: str, mesh_name: str, mesh_password: str) -> bool:
+    def _encrypted_auth_payload(self, creds: Dict[str, bytes]) -> bytes:
         """
-        Authentication method 3: Encrypted authentication using discovered AES keys
+        Encrypt the credential payload once per credential set and reuse it for every device
         """
-        try:
-            from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-            from cryptography.hazmat.primitives import padding
-            
+        key = creds['combined']
+        if key not in self._enc_auth:
             # Create authentication payload
-            auth_payload = f"{mesh_name}:{mesh_password}".encode('utf-8')
+            auth_payload = key
             
             # Encrypt with discovered keys
-            cipher = Cipher(algorithms.AES(self.AES_KEY[:32]), modes.CBC(self.AES_IV[:16]))
-            encryptor = cipher.encryptor()
+            encryptor = self._AES_CIPHER.encryptor()
             
             # Pad the payload
             padder = padding.PKCS7(128).padder()  # AES block size is 128 bits
             padded_data = padder.update(auth_payload)
             padded_data += padder.finalize()
             
-            encrypted_payload = encryptor.update(padded_data) + encryptor.finalize()
+            self._enc_auth[key] = encryptor.update(padded_data) + encryptor.finalize()
+        
+        return self._enc_auth[key]
+    
+    async def _auth_method_3(self, device_address: str, creds: Dict[str, bytes]) -> bool:
+        """
+        Authentication method 3: Encrypted authentication using discovered AES keys
+        """
+        if not _HAS_CRYPTO:
+            logger.warning("Cryptography library not available, skipping encrypted authentication")
+            return False
+        
+        try:
+            encrypted_payload = self._encrypted_auth_payload(creds)
             
             client = self.connected_devices[device_address]
             characteristics = self.device_characteristics.get(device_address, {})
             
-            for char_key, characteristic in characteristics.items():
-                if "writable" in char_key:
-                    try:
-                        await client.write_gatt_char(characteristic, encrypted_payload)
-                        await asyncio.sleep(0.5)
-                        return True
-                    except Exception as e:
-                        logger.debug(f"Auth method 3 failed on {characteristic.uuid}: {e}")
-                        
-        except ImportError:
-            logger.warning("Cryptography library not available, skipping encrypted authentication")
+            for characteristic in characteristics.get("writable", []):
+                try:
+                    await self._write_acknowledged(client, characteristic, encrypted_payload)
+                    return True
+                except Exception as e:
+                    if self._is_auth_rejection(e):
+                        raise
+                    logger.debug("Auth method 3 failed on %s: %s", characteristic.uuid, e)
+                    
         except Exception as e:
-            logger.debug(f"Auth method 3 failed: {e}")
+            if self._is_auth_rejection(e):
+                raise
+            logger.debug("Auth method 3 failed: %s", e)
         
         return False
     
@@ -343,11 +499,23 @@ class UrbanMeshController:
         """
         return await self._send_light_command(device_address, light_id, False)
     
+    async def turn_on_group(self, device_address: str, group_address: int = MESH_GROUP_ADDRESS) -> bool:
+        """
+        Turn on every light in a mesh group through one connected node
+        """
+        return await self._send_light_command(device_address, group_address, True)
+    
+    async def turn_off_group(self, device_address: str, group_address: int = MESH_GROUP_ADDRESS) -> bool:
+        """
+        Turn off every light in a mesh group through one connected node
+        """
+        return await self._send_light_command(device_address, group_address, False)
+    
     async def _send_light_command(self, device_address: str, light_id: int, turn_on: bool) -> bool:
         """
         Send light control command based on app analysis
         """
-        if not self.authenticated_devices.get(device_address, False):
+        if device_address not in self.authenticated_devices:
             logger.warning(f"Device {device_address} not authenticated, attempting authentication first")
             if not await self.authenticate_with_mesh(device_address):
                 return False
@@ -355,54 +523,112 @@ class UrbanMeshController:
         client = self.connected_devices.get(device_address)
         characteristics = self.device_characteristics.get(device_address, {})
         
-        if not client or not characteristics:
+        if not client or not characteristics.get("writable"):
             logger.error(f"No connection or characteristics for {device_address}")
             return False
         
         # Command patterns derived from app analysis
         command_patterns = [
             # Pattern 1: Simple on/off command
-            struct.pack('<BHB', 0x01, light_id, 0x01 if turn_on else 0x00),
+            self._CMD_SIMPLE.pack(0x01, light_id, 0x01 if turn_on else 0x00),
             # Pattern 2: Extended command
-            struct.pack('<BBHB', 0x02, 0x01, light_id, 0xFF if turn_on else 0x00),
+            self._CMD_EXTENDED.pack(0x02, 0x01, light_id, 0xFF if turn_on else 0x00),
             # Pattern 3: Mesh command format
-            struct.pack('<BBBH', 0x03, 0x01 if turn_on else 0x00, 0x00, light_id),
+            self._CMD_MESH.pack(0x03, 0x01 if turn_on else 0x00, 0x00, light_id),
         ]
         
+        confirmed = await self._command_confirmation(device_address)
+        if confirmed is not None:
+            confirmed.clear()
+        
+        # Writable mesh characteristics only, else every writable one in discovery order
+        targets = [
+            characteristic for characteristic in characteristics.get("mesh", [])
+            if "write" in characteristic.properties or "write-without-response" in characteristic.properties
+        ] or characteristics["writable"]
+        
+        logger.info(f"Sending {'ON' if turn_on else 'OFF'} command to light {light_id}")
+        if logger.isEnabledFor(logging.DEBUG):
+            for pattern in command_patterns:
+                logger.debug("Command data: %s", pattern.hex())
+        
+        # One GATT operation at a time: Android's BluetoothGatt rejects overlapping writes
+        sent = False
         for pattern in command_patterns:
-            for char_key, characteristic in characteristics.items():
-                if "writable" in char_key:
-                    try:
-                        logger.info(f"Sending {'ON' if turn_on else 'OFF'} command to light {light_id}")
-                        logger.debug(f"Command data: {binascii.hexlify(pattern)}")
-                        
-                        await client.write_gatt_char(characteristic, pattern)
-                        await asyncio.sleep(0.5)
-                        
-                        logger.info(f"Command sent successfully")
-                        return True
-                        
-                    except Exception as e:
-                        logger.debug(f"Command failed on {characteristic.uuid}: {e}")
+            for characteristic in targets:
+                try:
+                    await self._write_acknowledged(client, characteristic, pattern)
+                    sent = True
+                    break
+                except Exception as e:
+                    logger.debug("Command failed on %s: %s", characteristic.uuid, e)
+            if sent:
+                break
         
-        logger.error(f"All command patterns failed for device {device_address}")
-        return False
+        if not sent:
+            logger.error(f"All command patterns failed for device {device_address}")
+            return False
+        
+        # A notification from the light confirms the command; stop waiting as soon as it arrives
+        if confirmed is not None:
+            try:
+                await asyncio.wait_for(confirmed.wait(), timeout=0.5)
+                logger.info(f"Command confirmed by {device_address}")
+            except asyncio.TimeoutError:
+                logger.debug("No confirmation notification from %s", device_address)
+        
+        logger.info(f"Command sent successfully")
+        return True
     
-    async def disconnect_all(self):
+    async def _command_confirmation(self, device_address: str) -> Optional[asyncio.Event]:
         """
-        Disconnect from all connected devices
+        Subscribe once to a notify characteristic and return the event it sets
+        
+        Returns None if the device has no usable notify characteristic.
         """
-        for address, client in list(self.connected_devices.items()):
+        if device_address in self._command_events:
+            return self._command_events[device_address]
+        
+        client = self.connected_devices[device_address]
+        characteristics = self.device_characteristics.get(device_address, {})
+        event = None
+        
+        for characteristic in characteristics.get("notify", []):
+            event = asyncio.Event()
             try:
-                if client.is_connected:
-                    await client.disconnect()
-                    logger.info(f"Disconnected from {address}")
+                await client.start_notify(characteristic, lambda sender, data, event=event: event.set())
+                break
             except Exception as e:
-                logger.error(f"Error disconnecting from {address}: {e}")
+                logger.debug("Could not subscribe to %s: %s", characteristic.uuid, e)
+                event = None
+        
+        self._command_events[device_address] = event
+        return event
+    
+    async def _safe_disconnect(self, address: str, client: BleakClient):
+        """
+        Disconnect a single device, logging instead of raising on failure
+        """
+        try:
+            if client.is_connected:
+                await client.disconnect()
+                logger.info(f"Disconnected from {address}")
+        except Exception as e:
+            logger.error(f"Error disconnecting from {address}: {e}")
+    
+    async def disconnect_all(self):
+        """
+        Disconnect from all connected devices
+        """
+        await asyncio.gather(
+            *(self._safe_disconnect(address, client) for address, client in list(self.connected_devices.items())),
+            return_exceptions=True,
+        )
         
         self.connected_devices.clear()
         self.device_characteristics.clear()
         self.authenticated_devices.clear()
+        self._command_events.clear()
 
 async def main():
     """
@@ -421,49 +647,65 @@ async def main():
         
         print(f"✅ Found {len(devices)} potential URBARN devices")
         
-        # Step 2: Connect to each device
-        connected_count = 0
-        for device in devices:
-            print(f"\n🔗 Attempting to connect to {device.name or 'Unknown'} ({device.address})")
+        # Step 2: Connect to each device concurrently
+        async def process_device(device: BLEDevice) -> bool:
+            label = f"{device.name or 'Unknown'} ({device.address})"
+            print(f"\n🔗 Attempting to connect to {label}")
             
-            if await controller.connect_to_device(device):
-                connected_count += 1
-                print(f"✅ Connected successfully")
-                
-                # Step 3: Authenticate with mesh
-                print("🔐 Authenticating with mesh network...")
-                if await controller.authenticate_with_mesh(device.address):
-                    print("✅ Authentication successful")
-                    
-                    # Step 4: Test light control
-                    print("💡 Testing light control...")
-                    
-                    # Turn on
-                    if await controller.turn_on_light(device.address, light_id=1):
-                        print("✅ Successfully turned light ON")
-                        await asyncio.sleep(2)
-                        
-                        # Turn off
-                        if await controller.turn_off_light(device.address, light_id=1):
-                            print("✅ Successfully turned light OFF")
-                        else:
-                            print("❌ Failed to turn light OFF")
-                    else:
-                        print("❌ Failed to turn light ON")
-                        
-                        # Try secondary credentials
-                        print("🔄 Trying secondary mesh credentials...")
-                        if await controller.authenticate_with_mesh(device.address, use_secondary_creds=True):
-                            print("✅ Secondary authentication successful")
-                            if await controller.turn_on_light(device.address, light_id=1):
-                                print("✅ Successfully turned light ON with secondary creds")
-                                await asyncio.sleep(2)
-                                await controller.turn_off_light(device.address, light_id=1)
+            if not await controller.connect_to_device(device):
+                print(f"❌ {label}: Connection failed")
+                return False
+            
+            print(f"✅ {label}: Connected successfully")
+            
+            # Step 3: Authenticate with mesh
+            print(f"🔐 {label}: Authenticating with mesh network...")
+            if not await controller.authenticate_with_mesh(device.address):
+                print(f"❌ {label}: Authentication failed")
+                return True
+            
+            print(f"✅ {label}: Authentication successful")
+            
+            # Step 4: Test light control
+            print(f"💡 {label}: Testing light control...")
+            
+            # Turn on
+            if await controller.turn_on_light(device.address, light_id=1):
+                print(f"✅ {label}: Successfully turned light ON")
+                await asyncio.sleep(2)
                 
+                # Turn off
+                if await controller.turn_off_light(device.address, light_id=1):
+                    print(f"✅ {label}: Successfully turned light OFF")
                 else:
-                    print("❌ Authentication failed")
+                    print(f"❌ {label}: Failed to turn light OFF")
             else:
-                print("❌ Connection failed")
+                print(f"❌ {label}: Failed to turn light ON")
+                
+                # Try secondary credentials
+                print(f"🔄 {label}: Trying secondary mesh credentials...")
+                if await controller.authenticate_with_mesh(device.address, use_secondary_creds=True):
+                    print(f"✅ {label}: Secondary authentication successful")
+                    if await controller.turn_on_light(device.address, light_id=1):
+                        print(f"✅ {label}: Successfully turned light ON with secondary creds")
+                        await asyncio.sleep(2)
+                        await controller.turn_off_light(device.address, light_id=1)
+            
+            return True
+        
+        # Typical BlueZ/Android concurrent connection limit
+        connect_limit = asyncio.Semaphore(6)
+        
+        async def bounded(device: BLEDevice) -> bool:
+            async with connect_limit:
+                return await process_device(device)
+        
+        results = await asyncio.gather(*(bounded(d) for d in devices), return_exceptions=True)
+        
+        for device, result in zip(devices, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error processing {device.address}: {result}")
+        connected_count = sum(1 for result in results if result is True)
         
         if connected_count == 0:
             print("❌ Could not connect to any devices")